@@ -2,25 +2,60 @@
 """Simple application for practicing rhythmic dictation."""
 
 import argparse
-from contextlib import ExitStack
+import bisect
+import collections
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, suppress
+import functools
+import hashlib
+import itertools
 import logging
-import pathlib
+import multiprocessing
+import os
 import random
 import shutil
-from string import Template
+import signal
 import subprocess
 import sys
 import tempfile
-from typing import Optional, List, Sequence, Tuple
+from typing import (
+    AbstractSet,
+    Deque,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Optional,
+    List,
+    Sequence,
+    Tuple,
+)
 from typed_argparse import TypedArgs  # type: ignore
 
-lilypond_midi_score = Template(
-    r"""\version "2.22.2"
+# Lilypond score of a rhythm, filled in with str.format. Braces that are part of
+# the lilypond syntax are doubled.
+lilypond_score = r"""\version "2.22.2"
+
+\paper {{
+  #(set-paper-size "a6landscape")
+}}
 
-\score {
-  \new Staff {
-    \relative {
-      \tempo 4 = $tempo
+\score {{
+  \new Staff {{
+    \relative a' {{
+      \tempo 4 = {tempo}
+      \numericTimeSignature
+      \time {timeSignature}
+      \voiceOne
+      {notes}
+    }}
+  }}
+  \layout {{ }}
+}}
+
+\score {{
+  \new Staff {{
+    \relative {{
+      \tempo 4 = {tempo}
       \numericTimeSignature
       \time 4/4
 
@@ -28,36 +63,36 @@ lilypond_midi_score = Template(
       \voiceOne
       c' c c c
 
-      \time $timeSignature
-      \set Staff.midiInstrument = "$midiInstrument"
+      \time {timeSignature}
+      \set Staff.midiInstrument = "{midiInstrument}"
       \voiceOne
-      $notes
-    }
-  }
-  \midi { }
-}"""
-)
-
-lilypond_layout_score = Template(
-    r"""\version "2.22.2"
-
-\paper {
-  #(set-paper-size "a6landscape")
+      {notes}
+    }}
+  }}
+  \midi {{ }}
+}}"""
+
+# The parts of lilypond_score between its {notes} fields. The notes are by far
+# the longest part of a score, so they are written out separately rather than
+# formatted along with the other fields.
+lilypond_score_parts = tuple(lilypond_score.split("{notes}"))
+
+# Note values in 16ths that need to be written as more than one rest.
+rest_values = {
+    12: (4, 8),
+    6: (2, 4),
 }
 
-\score {
-  \new Staff {
-    \relative a' {
-      \tempo 4 = $tempo
-      \numericTimeSignature
-      \time $timeSignature
-      \voiceOne
-      $notes
-    }
-  }
-  \layout { }
-}"""
-)
+# Lilypond durations of note values in 16ths.
+lilypond_values = {
+    16: "1",
+    12: "2.",
+    8: "2",
+    6: "4.",
+    4: "4",
+    2: "8",
+    1: "16",
+}
 
 
 def gen_rhythm(
@@ -81,25 +116,91 @@ def gen_rhythm(
         length given specific durations. If that happens, this error is raised.
     """
 
-    iter_max = 500
-
-    notes = [0]
-    sixteenths = beats * 4
-    current_sixteenths = 0
-    iter_counter = 0
-    while current_sixteenths != sixteenths:
-        iter_counter += 1
-        if iter_counter > iter_max:
-            raise ValueError(
-                "Given note values cannot create rhythm of the given length"
-            )
+    return gen_rhythm_multi(1, beats=beats, note_values=note_values)
+
+
+@functools.lru_cache(maxsize=None)
+def count_rhythms(sixteenths: int, note_values: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Counts the rhythms that can be made from the given durations.
+
+    Args:
+      sixteenths: Longest rhythm length to count, in 16ths.
+      note_values: The durations in 16ths that rhythms are made of.
+
+    Returns:
+      A tuple where the nth item is the number of distinct rhythms (ordered
+      sequences of note_values) that are exactly n 16ths long.
+    """
+    ways = [1] + [0] * sixteenths
+    for n in range(1, sixteenths + 1):
+        ways[n] = sum(ways[n - v] for v in note_values if v <= n)
+    return tuple(ways)
+
 
-        current_sixteenths -= notes.pop()
+@functools.lru_cache(maxsize=None)
+def rhythm_cum_weights(
+    sixteenths: int, note_values: Tuple[int, ...]
+) -> Tuple[Tuple[int, ...], ...]:
+    """Computes the weights used to draw each note of a rhythm.
+
+    Args:
+      sixteenths: Longest rhythm length to compute weights for, in 16ths.
+      note_values: The durations in 16ths that rhythms are made of.
 
-        while current_sixteenths < sixteenths:
-            note_val = random.choice(note_values)
+    Returns:
+      A tuple where the nth item holds cumulative weights, in the order of
+      note_values, for picking the first note of a rhythm n 16ths long. Each
+      note is weighted by the number of ways the rest of the rhythm can be
+      completed (see count_rhythms), which makes every rhythm equally likely.
+    """
+    ways = count_rhythms(sixteenths, note_values)
+    return tuple(
+        tuple(itertools.accumulate(ways[n - v] if v <= n else 0 for v in note_values))
+        for n in range(sixteenths + 1)
+    )
+
+
+def gen_rhythm_multi(
+    measures: int,
+    beats: int = 4,
+    note_values: Sequence[int] = (16, 12, 8, 6, 4, 2),
+) -> List[int]:
+    """Generates a rhythm spanning several measures.
+
+    Each measure is drawn uniformly from every rhythm of the right length that
+    can be made from the given durations, and no note crosses a barline, so
+    the result is the same as concatenating measures calls to gen_rhythm.
+
+    Args:
+      measures: Number of measures to generate.
+      beats: Length of each measure in quarters (default 4)
+      note_values: The durations in 16ths to use when generating the rhythm.
+        See gen_rhythm. (default (16, 12, 8, 6, 4, 2))
+
+    Returns:
+      A sequence of durations in 16ths, see gen_rhythm.
+
+    Raises:
+      ValueError: A measure of the given length cannot be created from the
+        given durations.
+    """
+    values = tuple(sorted(set(note_values)))
+    measure_sixteenths = beats * 4
+    if count_rhythms(measure_sixteenths, values)[measure_sixteenths] == 0:
+        raise ValueError("Given note values cannot create rhythm of the given length")
+
+    cum_weights = rhythm_cum_weights(measure_sixteenths, values)
+    # Bound to locals to skip the global and attribute lookups for each note.
+    bisect_right = bisect.bisect_right
+    randrange = random.randrange
+    notes: List[int] = []
+    for _ in range(measures):
+        remaining = measure_sixteenths
+        while remaining:
+            weights = cum_weights[remaining]
+            note_val = values[bisect_right(weights, randrange(weights[-1]))]
             notes.append(note_val)
-            current_sixteenths += note_val
+            remaining -= note_val
 
     return notes
 
@@ -114,15 +215,7 @@ def sixteenths_to_rests(sixteenths: int) -> Sequence[int]:
       A tuple of the note values of rests that add up to the original note
       value.
     """
-    rests = {
-        12: (4, 8),
-        6: (2, 4),
-    }
-
-    if sixteenths in rests:
-        return rests[sixteenths]
-
-    return (sixteenths,)
+    return rest_values.get(sixteenths, (sixteenths,))
 
 
 def sixteenths_to_lilypond(sixteenths: int) -> str:
@@ -139,16 +232,90 @@ def sixteenths_to_lilypond(sixteenths: int) -> str:
       KeyError: The given note value in 16ths does not have a single
         note lilypond length equivalent.
     """
-    sixteenths_to_vals = {
-        16: "1",
-        12: "2.",
-        8: "2",
-        6: "4.",
-        4: "4",
-        2: "8",
-        1: "16",
+    return lilypond_values[sixteenths]
+
+
+# Lilypond strings of each note value in 16ths, played and as rests.
+note_strings = {n: "a" + sixteenths_to_lilypond(n) for n in lilypond_values}
+rest_strings = {
+    n: tuple("r" + sixteenths_to_lilypond(val) for val in sixteenths_to_rests(n))
+    for n in lilypond_values
+}
+
+
+def notes_to_lilypond(notes: Sequence[int], rests: AbstractSet[int]) -> Iterator[str]:
+    """Converts a rhythm to lilypond's string representation.
+
+    Args:
+      notes: The note values in 16ths of the rhythm, see gen_rhythm.
+      rests: Indices into notes of the notes that should be rests.
+
+    Yields:
+      The lilypond notes and rests of the rhythm, one at a time.
+    """
+    for i, note in enumerate(notes):
+        if i in rests:
+            yield from rest_strings[note]
+        else:
+            yield note_strings[note]
+
+
+@functools.lru_cache(maxsize=None)
+def score_parts(
+    tempo: int, time_signature: str, midi_instrument: str
+) -> Tuple[str, ...]:
+    """Fills in everything but the notes in lilypond_score_parts.
+
+    Only the time signature changes between rounds of a session, so this ends
+    up being done once for each of a handful of time signatures.
+
+    Args:
+      tempo: Tempo in quarters per minute.
+      time_signature: Lilypond time signature, for instance "3/4".
+      midi_instrument: MIDI instrument used to play the rhythm.
+
+    Returns:
+      The filled in parts of the score, to be joined with its notes.
+    """
+    fields = {
+        "tempo": tempo,
+        "timeSignature": time_signature,
+        "midiInstrument": midi_instrument,
     }
-    return sixteenths_to_vals[sixteenths]
+    return tuple(part.format_map(fields) for part in lilypond_score_parts)
+
+
+def score_chunks(
+    tempo: int,
+    time_signature: str,
+    midi_instrument: str,
+    notes: Sequence[int],
+    rests: AbstractSet[int],
+) -> Iterator[str]:
+    """Fills in lilypond_score piece by piece.
+
+    The score is produced in small chunks so that it can be written out without
+    ever building the whole string, which is mostly notes for long rhythms.
+
+    Args:
+      tempo: Tempo in quarters per minute.
+      time_signature: Lilypond time signature, for instance "3/4".
+      midi_instrument: MIDI instrument used to play the rhythm.
+      notes: The note values in 16ths of the rhythm, see gen_rhythm.
+      rests: Indices into notes of the notes that should be rests.
+
+    Yields:
+      Consecutive chunks of the lilypond score.
+    """
+    parts = score_parts(tempo, time_signature, midi_instrument)
+
+    yield parts[0]
+    for part in parts[1:]:
+        for i, token in enumerate(notes_to_lilypond(notes, rests)):
+            if i:
+                yield " "
+            yield token
+        yield part
 
 
 class Arguments(TypedArgs):
@@ -168,7 +335,13 @@ class Arguments(TypedArgs):
         showing the correct answer (also searched for in PATH).
       midi_player: Path to an executable for a midi player to use when
         playing the rhythm (also searched for in PATH).
+      audio_player: Path to an executable for an audio player. If given, the
+        rhythm is rendered to a WAV file once with midi_player and replayed
+        with this instead of synthesizing the midi every time (also searched
+        for in PATH).
       lilypond_path: Path to lilypond executable (also searched for in PATH).
+      png_dpi: Resolution of the image of the correct answer.
+      jobs: Number of rounds to render in parallel ahead of time.
       verbose: Print non-warning/error log messages and subprocess output.
     """
 
@@ -180,7 +353,10 @@ class Arguments(TypedArgs):
     midi_instrument: str
     image_viewer: str
     midi_player: str
+    audio_player: Optional[str]
     lilypond_path: str
+    png_dpi: int
+    jobs: int
     verbose: bool
 
 
@@ -269,12 +445,41 @@ def parse_args(args: List[str]) -> Arguments:
         help="program used to play MIDI file of the rhythm (default: timidity)",
     )
 
+    arg_parser.add_argument(
+        "--audio-player",
+        help=(
+            "program used to replay a WAV file of the rhythm rendered once by "
+            "the midi player, which must support timidity's -Ow and -o "
+            "options, e.g. aplay (default: play the MIDI file every time)"
+        ),
+    )
+
     arg_parser.add_argument(
         "--lilypond-path",
         default="lilypond",
         help=("location of lilypond executable" "(can be in PATH, default: lilypond)"),
     )
 
+    arg_parser.add_argument(
+        "--png-dpi",
+        dest="png_dpi",
+        type=int,
+        default=72,
+        help="resolution of the image of the correct answer (default: 72)",
+    )
+
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help=(
+            "number of lilypond processes used to render upcoming rounds "
+            "in the background (default: 1)"
+        ),
+    )
+
     arg_parser.add_argument(
         "-v",
         "--verbose",
@@ -287,6 +492,25 @@ def parse_args(args: List[str]) -> Arguments:
     return Arguments(parsed_args)
 
 
+@functools.lru_cache(maxsize=None)
+def find_program(program: str) -> Optional[str]:
+    """Looks up an executable like shutil.which, remembering the result.
+
+    Each lookup stats every directory in PATH, so a program given for more
+    than one option is only searched for once.
+
+    Args:
+      program: Name of or path to the executable.
+
+    Returns:
+      The absolute path to the executable, or None if it could not be found.
+    """
+    path = shutil.which(program)
+    if path is None:
+        return None
+    return os.path.abspath(path)
+
+
 def validate_args(args: Arguments) -> Arguments:
     """Validates Arguments class for correctness.
 
@@ -294,6 +518,9 @@ def validate_args(args: Arguments) -> Arguments:
     types but is not necessarily semantically correct. For instance, tempo
     should not be less than 1.
 
+    Program paths are replaced with the absolute paths of the executables they
+    resolve to, so that running them later does not search PATH again.
+
     Args:
       args: Arguments data class to validate.
 
@@ -314,24 +541,42 @@ def validate_args(args: Arguments) -> Arguments:
         raise ValueError(f"No. measures {args.measures} is not greater than 1")
 
     valid_values = {16, 12, 8, 6, 4, 2, 1}
-    if not all(map(lambda n: n in valid_values, args.note_values)):
+    if not valid_values.issuperset(args.note_values):
         raise ValueError(f"Note values must be one of {valid_values}")
 
     if args.num_rests < 0:
         raise ValueError("Number of rests must be greater than or equal to 0")
 
+    if args.png_dpi < 1:
+        raise ValueError(f"PNG resolution {args.png_dpi} is not greater than 1")
+
+    if args.jobs < 1:
+        raise ValueError(f"No. jobs {args.jobs} is not greater than 1")
+
     # TODO: probably need to validate args.midi_instrument
 
-    if shutil.which(args.image_viewer) is None:
+    image_viewer = find_program(args.image_viewer)
+    if image_viewer is None:
         raise FileNotFoundError(f"Image viewer {args.image_viewer} not found")
+    args.image_viewer = image_viewer
 
-    if shutil.which(args.midi_player) is None:
+    midi_player = find_program(args.midi_player)
+    if midi_player is None:
         raise FileNotFoundError(f"Midi player {args.midi_player} not found")
+    args.midi_player = midi_player
 
-    if shutil.which(args.lilypond_path) is None:
+    if args.audio_player is not None:
+        audio_player = find_program(args.audio_player)
+        if audio_player is None:
+            raise FileNotFoundError(f"Audio player {args.audio_player} not found")
+        args.audio_player = audio_player
+
+    lilypond_path = find_program(args.lilypond_path)
+    if lilypond_path is None:
         raise FileNotFoundError(
             f"Lilypond executable could not be found at {args.lilypond_path}"
         )
+    args.lilypond_path = lilypond_path
 
     return args
 
@@ -341,125 +586,395 @@ def configure_logging() -> None:
     logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
 
 
-def practice_round(args: Arguments) -> None:
-    """Runs a single round of rhythmic dictation practice.
+# Number of rendered scores kept in the cache, see prune_cache. Each one is a
+# small image and midi file.
+max_cached_scores = 256
+
+
+def cache_dir() -> str:
+    """Returns the directory rendered scores are cached in.
+
+    This follows the XDG base directory specification, so it is
+    $XDG_CACHE_HOME/rhythmic_dictation, or ~/.cache/rhythmic_dictation if
+    XDG_CACHE_HOME is not set.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "rhythmic_dictation")
+
+
+def cache_file(src: str, dest: str) -> None:
+    """Copies a rendered file into the cache.
+
+    The file is copied next to its destination first and then moved into
+    place, so a concurrent reader never sees a partially written file.
+
+    Args:
+      src: File to cache.
+      dest: Path of the file in the cache directory.
+
+    Raises:
+      OSError: The file could not be cached.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    temp_dest = f"{dest}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(src, temp_dest)
+        os.replace(temp_dest, dest)
+    except OSError:
+        with suppress(FileNotFoundError):
+            os.remove(temp_dest)
+        raise
+
+
+def prune_cache(max_scores: int) -> None:
+    """Deletes the least recently used scores from the cache.
+
+    Rhythms are drawn from far too many possibilities for most of them to ever
+    come up again, so only the most recently used scores are worth keeping.
+
+    Args:
+      max_scores: Number of scores to keep.
+
+    Raises:
+      OSError: The cache directory could not be read.
+    """
+    score_files: Dict[str, List[str]] = collections.defaultdict(list)
+    last_used: Dict[str, float] = collections.defaultdict(float)
+    try:
+        with os.scandir(cache_dir()) as entries:
+            for entry in entries:
+                # Another session may be pruning the cache at the same time.
+                with suppress(FileNotFoundError):
+                    key = entry.name.split(".", 1)[0]
+                    last_used[key] = max(last_used[key], entry.stat().st_mtime)
+                    score_files[key].append(entry.path)
+    except FileNotFoundError:
+        return
+
+    by_last_use = sorted(last_used, key=last_used.__getitem__, reverse=True)
+    for key in by_last_use[max_scores:]:
+        logging.info("Removing score %s from the cache", key)
+        for fn in score_files[key]:
+            with suppress(FileNotFoundError):
+                os.remove(fn)
+
+
+class PreparedRound(NamedTuple):
+    """A practice round whose image and midi have been rendered.
+
+    Attributes:
+      png_fn: Image of the correct answer.
+      midi_fn: MIDI file of the rhythm.
+      wav_fn: Rendering of midi_fn, if an audio player is used.
+    """
+
+    png_fn: str
+    midi_fn: str
+    wav_fn: Optional[str]
+
+
+def init_worker() -> None:
+    """Initializes a worker process that prepares rounds in the background.
+
+    Workers start a new session so that Ctrl-C in the terminal, which closes
+    the image viewer (see ask_another), does not also kill the rounds being
+    prepared or the programs rendering them. They are stopped with
+    stop_workers instead. Workers also reseed the random number generator so
+    that they do not generate the same rhythms as their parent.
+    """
+    os.setsid()
+    random.seed()
+
+
+def stop_workers() -> None:
+    """Kills the worker processes and the programs they are running.
+
+    Each worker leads its own process group (see init_worker), so signalling
+    the group also stops any lilypond or midi player it has started, instead
+    of waiting for them to finish rendering rounds that will not be played.
+    """
+    for worker in multiprocessing.active_children():
+        with suppress(ProcessLookupError):
+            os.killpg(worker.pid, signal.SIGTERM)
+
+
+def prepare_round(args: Arguments, temp_dir: str, name: str) -> PreparedRound:
+    """Generates a rhythm and renders its image and midi.
 
     Args:
       args: Arguments to the program as returned by parse_args
+      temp_dir: Directory to render the round into.
+      name: File name without extension to give the round's files. Rounds
+        sharing temp_dir must have different names.
+
+    Returns:
+      The prepared round.
     """
     out = None
     err = None
+    lilypond_log_level: Tuple[str, ...] = ("-V",)
     if not args.verbose:
         out = subprocess.DEVNULL
         err = subprocess.DEVNULL
+        lilypond_log_level = ("-l", "ERROR")
 
-    with ExitStack() as exit_stack:
-        temp_dir = exit_stack.enter_context(
-            tempfile.TemporaryDirectory(prefix="rhythmic_dictation")
-        )
-        logging.info("Created temporary directory %s", temp_dir)
+    if args.bpmeasure is None:
+        bpmeasure = random.choice((2, 3, 4))
+    else:
+        bpmeasure = args.bpmeasure
 
-        layout_score_fn = pathlib.Path(temp_dir) / "layout_score.ly"
-        layout_score_file = exit_stack.enter_context(
-            open(layout_score_fn, "w", encoding="utf-8")
-        )
+    logging.info("Generating note durations ...")
+    notes = gen_rhythm_multi(
+        args.measures, beats=bpmeasure, note_values=args.note_values
+    )
 
-        logging.info("Created layout lilypond score file %s", layout_score_fn)
-        midi_score_fn = pathlib.Path(temp_dir) / "midi_score.ly"
-        midi_score_file = exit_stack.enter_context(
-            open(midi_score_fn, "w", encoding="utf-8")
+    logging.info("Adding rests ...")
+    rests = set(random.sample(range(len(notes)), k=min(args.num_rests, len(notes))))
+
+    def score() -> Iterator[str]:
+        return score_chunks(
+            args.tempo, f"{bpmeasure}/4", args.midi_instrument, notes, rests
         )
-        logging.info("Created lilypond score file for MIDI output %s", midi_score_fn)
 
-        if args.bpmeasure is None:
-            bpmeasure = random.choice((2, 3, 4))
+    png_fn = os.path.join(temp_dir, f"{name}.png")
+    midi_fn = os.path.join(temp_dir, f"{name}.midi")
+
+    score_hash = hashlib.sha1()
+    for chunk in score():
+        score_hash.update(chunk.encode("utf-8"))
+    score_hash.update(f"resolution={args.png_dpi}".encode("utf-8"))
+    # A different or upgraded lilypond may render the same score differently.
+    lilypond_fn = os.path.realpath(args.lilypond_path)
+    lilypond_mtime = os.stat(lilypond_fn).st_mtime_ns
+    score_hash.update(f"lilypond={lilypond_fn}:{lilypond_mtime}".encode("utf-8"))
+    key = score_hash.hexdigest()
+    cached_png_fn = os.path.join(cache_dir(), f"{key}.png")
+    cached_midi_fn = os.path.join(cache_dir(), f"{key}.midi")
+
+    # The cache only saves time, so the round goes ahead without it if it
+    # cannot be read or written.
+    cached = False
+    if os.path.exists(cached_png_fn) and os.path.exists(cached_midi_fn):
+        logging.info("Using cached image and midi for score %s", key)
+        try:
+            shutil.copyfile(cached_png_fn, png_fn)
+            shutil.copyfile(cached_midi_fn, midi_fn)
+            cached = True
+        except OSError as error:
+            logging.warning("Could not read score %s from the cache: %s", key, error)
         else:
-            bpmeasure = args.bpmeasure
-        measures = args.measures
-
-        logging.info("Generating note durations ...")
-        notes: List[int] = []
-        for _ in range(measures):
-            notes.extend(gen_rhythm(beats=bpmeasure, note_values=args.note_values))
-
-        logging.info("Adding rests ...")
-        non_rests = list(range(len(notes)))
-        rests = set()
-        for _ in range(args.num_rests):
-            rest_index = random.choice(non_rests)
-            rests.add(rest_index)
-            non_rests.remove(rest_index)
-
-        notes_lilypond = []
-        for i, note in enumerate(notes):
-            if i in rests:
-                rest_vals = sixteenths_to_rests(note)
-                for val in rest_vals:
-                    notes_lilypond.append("r" + sixteenths_to_lilypond(val))
-            else:
-                notes_lilypond.append("a" + sixteenths_to_lilypond(note))
-
-        notes_lilypond_str = " ".join(notes_lilypond)
-
-        layout_score_string = lilypond_layout_score.substitute(
-            tempo=args.tempo, timeSignature=f"{bpmeasure}/4", notes=notes_lilypond_str
-        )
-        midi_score_string = lilypond_midi_score.substitute(
-            tempo=args.tempo,
-            timeSignature=f"{bpmeasure}/4",
-            notes=notes_lilypond_str,
-            midiInstrument=args.midi_instrument,
+            # Mark the score as recently used, see prune_cache.
+            with suppress(OSError):
+                os.utime(cached_png_fn)
+
+    if not cached:
+        logging.info("Converting score %s to image and midi ...", key)
+        lilypond = subprocess.Popen(
+            (
+                args.lilypond_path,
+                *lilypond_log_level,
+                "-dno-point-and-click",
+                f"-dresolution={args.png_dpi}",
+                "--png",
+                "-o",
+                name,
+                "-",
+            ),
+            cwd=temp_dir,
+            stdin=subprocess.PIPE,
+            stdout=out,
+            stderr=err,
+            # Lilypond reads its input as UTF-8, which is also what the cache
+            # key is computed from, whatever the locale's encoding is.
+            encoding="utf-8",
         )
-        layout_score_file.write(layout_score_string)
-        layout_score_file.flush()
-        midi_score_file.write(midi_score_string)
-        midi_score_file.flush()
-
-        logging.info("Converting %s to image ...", layout_score_fn)
+        assert lilypond.stdin is not None
+        # If lilypond exits early the pipe breaks; its exit code says why.
+        with suppress(BrokenPipeError), lilypond.stdin:
+            lilypond.stdin.writelines(score())
+        if lilypond.wait() != 0:
+            raise subprocess.CalledProcessError(lilypond.returncode, lilypond.args)
+
+        logging.info("Caching image and midi for score %s", key)
+        try:
+            cache_file(png_fn, cached_png_fn)
+            cache_file(midi_fn, cached_midi_fn)
+        except OSError as error:
+            logging.warning("Could not cache score %s: %s", key, error)
+
+    wav_fn = None
+    if args.audio_player is not None:
+        wav_fn = os.path.join(temp_dir, f"{name}.wav")
+        logging.info("Rendering %s to %s ...", midi_fn, wav_fn)
         subprocess.run(
-            (args.lilypond_path, "--png", layout_score_fn),
+            (args.midi_player, "-Ow", "-o", wav_fn, midi_fn),
             check=True,
-            cwd=temp_dir,
             stdout=out,
             stderr=err,
             text=True,
         )
-        logging.info("Converting %s to midi ...", midi_score_fn)
+
+    return PreparedRound(png_fn, midi_fn, wav_fn)
+
+
+class RoundQueue:
+    """Queue of practice rounds rendered ahead of time in worker processes.
+
+    Exactly args.jobs rounds are kept in flight, one per worker, and a new one
+    is only submitted when a round is taken off the queue. Submitting more
+    would not make rounds ready any sooner, as the executor hands work to its
+    workers early and such work can no longer be cancelled.
+
+    Attributes:
+      args: Arguments to the program as returned by parse_args
+      temp_dir: Directory rounds are rendered into, see prepare_round.
+      executor: Pool of worker processes that render the rounds.
+    """
+
+    def __init__(
+        self, args: Arguments, temp_dir: str, executor: ProcessPoolExecutor
+    ) -> None:
+        self.args = args
+        self.temp_dir = temp_dir
+        self.executor = executor
+        self._names = (f"round{i}" for i in itertools.count())
+        self._rounds: Deque["Future[PreparedRound]"] = collections.deque()
+        self._fill()
+
+    def _fill(self) -> None:
+        """Submits rounds until the queue is full."""
+        while len(self._rounds) < self.args.jobs:
+            self._rounds.append(
+                self.executor.submit(
+                    prepare_round, self.args, self.temp_dir, next(self._names)
+                )
+            )
+
+    def get(self) -> PreparedRound:
+        """Takes the next round off the queue, waiting for it if needed.
+
+        Returns:
+          The next prepared round.
+        """
+        future = self._rounds.popleft()
+        self._fill()
+        return future.result()
+
+
+def remove_round(prepared: PreparedRound) -> None:
+    """Deletes the files of a round that is over.
+
+    Args:
+      prepared: Round returned by prepare_round.
+    """
+    for fn in prepared:
+        if fn is None:
+            continue
+        with suppress(FileNotFoundError):
+            os.remove(fn)
+
+
+def play_round(args: Arguments, prepared: PreparedRound) -> subprocess.Popen:
+    """Plays a prepared round and then shows the correct answer.
+
+    The image viewer is left running so that the user can look at the answer
+    while deciding what to do next.
+
+    Args:
+      args: Arguments to the program as returned by parse_args
+      prepared: Round returned by prepare_round.
+
+    Returns:
+      The image viewer process, to be closed with close_viewer.
+    """
+    out = None
+    err = None
+    if not args.verbose:
+        out = subprocess.DEVNULL
+        err = subprocess.DEVNULL
+
+    if prepared.wav_fn is not None and args.audio_player is not None:
+        play_command = (args.audio_player, prepared.wav_fn)
+    else:
+        play_command = (args.midi_player, prepared.midi_fn)
+
+    while True:
+        logging.info("Playing rhythm ...")
         subprocess.run(
-            (args.lilypond_path, midi_score_fn),
+            play_command,
             check=True,
-            cwd=temp_dir,
             stdout=out,
             stderr=err,
             text=True,
+            # Everything the main process opens, including its pipes to the
+            # workers, is non-inheritable, so there is nothing to close. The
+            # workers may have inherited descriptors from the forkserver, so
+            # the programs they run use the default.
+            close_fds=False,
         )
+        again = input("Listen again (y/n)? ")
+        if again.lower() == "n":
+            break
 
-        while True:
-            logging.info("Playing midi ...")
-            subprocess.run(
-                (args.midi_player, "midi_score.midi"),
-                check=True,
-                cwd=temp_dir,
-                stdout=out,
-                stderr=err,
-                text=True,
-            )
-            again = input("Listen again (y/n)? ")
-            if again.lower() == "n":
-                break
+    logging.info("Showing correct answer")
+    return subprocess.Popen(
+        (args.image_viewer, prepared.png_fn),
+        stdout=out,
+        stderr=err,
+        text=True,
+        close_fds=False,
+    )
+
+
+def ask_another(viewer: subprocess.Popen) -> str:
+    """Asks whether to do another round while the answer is being shown.
+
+    Pressing Ctrl-C closes the image viewer and asks again. Once the viewer
+    is closed, Ctrl-C ends the session as usual.
+
+    Args:
+      viewer: The image viewer process returned by play_round.
 
-        logging.info("Showing correct answer")
+    Returns:
+      The user's answer.
+
+    Raises:
+      KeyboardInterrupt: Ctrl-C was pressed after the viewer was closed.
+    """
+    viewer_open = True
+    while True:
         try:
-            subprocess.run(
-                (args.image_viewer, "layout_score.png"),
-                check=True,
-                cwd=temp_dir,
-                stdout=out,
-                stderr=err,
-                text=True,
-            )
+            return input("Do another (y/n)? ")
         except KeyboardInterrupt:
-            pass
+            # The viewer gets the same Ctrl-C, so having been killed by it
+            # still counts as being open when it was pressed.
+            if not viewer_open or viewer.poll() not in (None, -signal.SIGINT):
+                raise
+            print()
+            viewer.terminate()
+            viewer_open = False
+
+
+def close_viewer(viewer: subprocess.Popen, check: bool = True) -> None:
+    """Closes the image viewer returned by play_round if it is still open.
+
+    Args:
+      viewer: The image viewer process.
+      check: Whether to raise an error if the viewer failed.
+
+    Raises:
+      subprocess.CalledProcessError: The viewer exited with an error before
+        it was closed.
+    """
+    returncode = viewer.poll()
+    if returncode is None:
+        viewer.terminate()
+        viewer.wait()
+    # Being closed with Ctrl-C or by ask_another is not an error.
+    elif check and returncode not in (0, -signal.SIGINT, -signal.SIGTERM):
+        raise subprocess.CalledProcessError(returncode, viewer.args)
 
 
 def main() -> int:
@@ -477,12 +992,43 @@ def main() -> int:
         level = logging.DEBUG
     logging.getLogger().setLevel(level)
 
-    while True:
-        practice_round(args)
+    with ExitStack() as exit_stack:
+        # One temporary directory is shared by every round of the session.
+        temp_dir = exit_stack.enter_context(
+            tempfile.TemporaryDirectory(prefix="rhythmic_dictation")
+        )
+        logging.info("Created temporary directory %s", temp_dir)
 
-        again = input("Do another (y/n)? ")
-        if again.lower() == "n":
-            break
+        try:
+            prune_cache(max_cached_scores)
+        except OSError as error:
+            logging.warning("Could not prune the cache: %s", error)
+
+        # Upcoming rounds are rendered in the background while the current one
+        # is being played, so that the user does not have to wait for lilypond.
+        executor = exit_stack.enter_context(
+            ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker)
+        )
+        # Rounds still being rendered when the session ends are never played,
+        # so kill them rather than waiting for them to finish.
+        exit_stack.callback(stop_workers)
+        rounds = RoundQueue(args, temp_dir, executor)
+
+        while True:
+            prepared = rounds.get()
+            try:
+                viewer = play_round(args, prepared)
+                try:
+                    again = ask_another(viewer)
+                except BaseException:
+                    close_viewer(viewer, check=False)
+                    raise
+                close_viewer(viewer)
+            finally:
+                remove_round(prepared)
+
+            if again.lower() == "n":
+                break
 
     return 0
 